@@ -46,10 +46,65 @@ def _create_model_from_test_proto(file_name,
                          ), config
 
 
+def _create_forward_fn(model, experiment_options, training=False):
+  """Wraps the forward pass of `model` in a traced tf.function.
+
+  Args:
+    model: A DeepLab model.
+    experiment_options: A config_pb2.ExperimentOptions configuration.
+    training: A boolean flag indicating whether training behavior should be
+      used.
+
+  Returns:
+    A function mapping an input tensor to the dictionary of model outputs.
+  """
+  # DeepLab resizes its outputs to the static input size, so the spatial
+  # dimensions of the input signature have to be fully defined.
+  crop_height, crop_width = experiment_options.train_dataset_options.crop_size
+  input_signature = [
+      tf.TensorSpec([None, crop_height, crop_width, 3], tf.float32)]
+
+  @tf.function(input_signature=input_signature)
+  def forward(input_tensor):
+    return model(input_tensor, training=training)
+
+  return forward
+
+
 class DeeplabTest(tf.test.TestCase):
 
+  @classmethod
+  def setUpClass(cls):
+    super().setUpClass()
+    # Building a model dominates the test time, so each model is built at most
+    # once and shared across the tests of this class.
+    cls._model_cache = {}
+    cls._forward_fn_cache = {}
+
+  @classmethod
+  def tearDownClass(cls):
+    cls._forward_fn_cache.clear()
+    cls._model_cache.clear()
+    super().tearDownClass()
+
+  def _get_model_from_test_proto(self,
+                                 file_name,
+                                 dataset_name='cityscapes_panoptic'):
+    key = (file_name, dataset_name)
+    if key not in self._model_cache:
+      self._model_cache[key] = _create_model_from_test_proto(
+          file_name, dataset_name=dataset_name)
+    return self._model_cache[key]
+
+  def _get_forward_fn(self, model, experiment_options, training=False):
+    key = (id(model), training)
+    if key not in self._forward_fn_cache:
+      self._forward_fn_cache[key] = _create_forward_fn(
+          model, experiment_options, training=training)
+    return self._forward_fn_cache[key]
+
   def test_deeplab_with_deeplabv3(self):
-    model, experiment_options = _create_model_from_test_proto(
+    model, experiment_options = self._get_model_from_test_proto(
         'example_cityscapes_deeplabv3.textproto')
     train_crop_size = tuple(
         experiment_options.train_dataset_options.crop_size)
@@ -58,7 +113,8 @@ class DeeplabTest(tf.test.TestCase):
     expected_semantic_shape = [
         2, train_crop_size[0], train_crop_size[1],
         experiment_options.model_options.deeplab_v3.num_classes]
-    resulting_dict = model(input_tensor)
+    resulting_dict = self._get_forward_fn(model, experiment_options)(
+        input_tensor)
     self.assertListEqual(
         resulting_dict[common.PRED_SEMANTIC_LOGITS_KEY].shape.as_list(),
         expected_semantic_shape)
@@ -67,7 +123,7 @@ class DeeplabTest(tf.test.TestCase):
     self.assertEqual(num_params, 39638355)
 
   def test_deeplab_with_deeplabv3plus(self):
-    model, experiment_options = _create_model_from_test_proto(
+    model, experiment_options = self._get_model_from_test_proto(
         'example_cityscapes_deeplabv3plus.textproto')
     train_crop_size = tuple(
         experiment_options.train_dataset_options.crop_size)
@@ -76,7 +132,8 @@ class DeeplabTest(tf.test.TestCase):
     expected_semantic_shape = [
         2, train_crop_size[0], train_crop_size[1],
         experiment_options.model_options.deeplab_v3_plus.num_classes]
-    resulting_dict = model(input_tensor)
+    resulting_dict = self._get_forward_fn(model, experiment_options)(
+        input_tensor)
     self.assertListEqual(
         resulting_dict[common.PRED_SEMANTIC_LOGITS_KEY].shape.as_list(),
         expected_semantic_shape)
@@ -85,7 +142,7 @@ class DeeplabTest(tf.test.TestCase):
     self.assertEqual(num_params, 39210947)
 
   def test_deeplab_with_deeplabv3_mv3l(self):
-    model, experiment_options = _create_model_from_test_proto(
+    model, experiment_options = self._get_model_from_test_proto(
         'example_cityscapes_deeplabv3_mv3l.textproto')
     train_crop_size = tuple(
         experiment_options.train_dataset_options.crop_size)
@@ -94,7 +151,8 @@ class DeeplabTest(tf.test.TestCase):
     expected_semantic_shape = [
         2, train_crop_size[0], train_crop_size[1],
         experiment_options.model_options.deeplab_v3.num_classes]
-    resulting_dict = model(input_tensor)
+    resulting_dict = self._get_forward_fn(model, experiment_options)(
+        input_tensor)
     self.assertListEqual(
         resulting_dict[common.PRED_SEMANTIC_LOGITS_KEY].shape.as_list(),
         expected_semantic_shape)
@@ -103,7 +161,7 @@ class DeeplabTest(tf.test.TestCase):
     self.assertEqual(num_params, 11024963)
 
   def test_deeplab_with_panoptic_deeplab(self):
-    model, experiment_options = _create_model_from_test_proto(
+    model, experiment_options = self._get_model_from_test_proto(
         'example_cityscapes_panoptic_deeplab.textproto')
     train_crop_size = tuple(
         experiment_options.train_dataset_options.crop_size)
@@ -117,7 +175,8 @@ class DeeplabTest(tf.test.TestCase):
         2, train_crop_size[0], train_crop_size[1]]
     expected_instance_regression_shape = [
         2, train_crop_size[0], train_crop_size[1], 2]
-    resulting_dict = model(input_tensor)
+    resulting_dict = self._get_forward_fn(model, experiment_options)(
+        input_tensor)
     self.assertListEqual(
         resulting_dict[common.PRED_SEMANTIC_LOGITS_KEY].shape.as_list(),
         expected_semantic_shape)
@@ -135,7 +194,7 @@ class DeeplabTest(tf.test.TestCase):
     self.assertEqual(num_params, 54973702)
 
   def test_deeplab_with_panoptic_deeplab_mv3l(self):
-    model, experiment_options = _create_model_from_test_proto(
+    model, experiment_options = self._get_model_from_test_proto(
         'example_cityscapes_panoptic_deeplab_mv3l.textproto')
     train_crop_size = tuple(
         experiment_options.train_dataset_options.crop_size)
@@ -149,7 +208,8 @@ class DeeplabTest(tf.test.TestCase):
         2, train_crop_size[0], train_crop_size[1]]
     expected_instance_regression_shape = [
         2, train_crop_size[0], train_crop_size[1], 2]
-    resulting_dict = model(input_tensor)
+    resulting_dict = self._get_forward_fn(model, experiment_options)(
+        input_tensor)
     self.assertListEqual(
         resulting_dict[common.PRED_SEMANTIC_LOGITS_KEY].shape.as_list(),
         expected_semantic_shape)
@@ -167,7 +227,7 @@ class DeeplabTest(tf.test.TestCase):
     self.assertEqual(num_params, 18236534)
 
   def test_deeplab_with_max_deeplab(self):
-    model, experiment_options = _create_model_from_test_proto(
+    model, experiment_options = self._get_model_from_test_proto(
         'example_coco_max_deeplab.textproto', dataset_name='coco_panoptic')
     train_crop_size = tuple(
         experiment_options.train_dataset_options.crop_size)
@@ -185,7 +245,8 @@ class DeeplabTest(tf.test.TestCase):
         max_deeplab.pixel_space_head.output_channels]
     expected_pixel_space_mask_logits_shape = [
         2, stride_4_size[0], stride_4_size[1], 128]
-    resulting_dict = model(input_tensor, training=True)
+    resulting_dict = self._get_forward_fn(
+        model, experiment_options, training=True)(input_tensor)
     self.assertListEqual(
         resulting_dict[common.PRED_SEMANTIC_LOGITS_KEY].shape.as_list(),
         expected_semantic_shape)
@@ -227,8 +288,10 @@ class DeeplabTest(tf.test.TestCase):
                             dataset.CITYSCAPES_PANOPTIC_INFORMATION)
 
   def test_deeplab_set_pooling(self):
-    model, _ = _create_model_from_test_proto(
+    model, _ = self._get_model_from_test_proto(
         'example_cityscapes_panoptic_deeplab.textproto')
+    # The model is shared with other tests, so restore its pool size.
+    self.addCleanup(model.set_pool_size, model.get_pool_size())
     pool_size = (10, 10)
     model.set_pool_size(pool_size)
 
@@ -238,8 +301,10 @@ class DeeplabTest(tf.test.TestCase):
         model._decoder._instance_decoder._aspp._aspp_pool._pool_size, pool_size)
 
   def test_deeplab_reset_pooling(self):
-    model, _ = _create_model_from_test_proto(
+    model, _ = self._get_model_from_test_proto(
         'example_cityscapes_panoptic_deeplab.textproto')
+    # The model is shared with other tests, so restore its pool size.
+    self.addCleanup(model.set_pool_size, model.get_pool_size())
     model.reset_pooling_layer()
     pool_size = (None, None)
     self.assertTupleEqual(
@@ -260,6 +260,9 @@ class Evaluator(orbit.StandardEvaluator):
       A dictionary of `Tensors`, which will be written to logs and as
       TensorBoard summaries.
     """
+    if self._enable_visualization or self._save_raw_predictions:
+      # Make sure all the predictions are on disk when the evaluation ends.
+      vis.wait_for_pending_writes()
     if not self._decode_groundtruth_label:
       return {}
 
@@ -14,8 +14,12 @@
 # limitations under the License.
 
 """Visualizes and stores results of a panoptic-deeplab model."""
+import atexit
+import collections
+from concurrent import futures
+import functools
 import os.path
-from typing import Any, Dict, List, Text
+from typing import Any, Callable, Dict, List, Optional, Sequence, Text, Tuple
 
 import numpy as np
 import tensorflow as tf
@@ -42,27 +46,102 @@ _SEMANTIC_PREDICTION_FORMAT = '%06d_semantic_prediction'
 # The format of others.
 _ANALYSIS_FORMAT = '%06d_semantic_error'
 
+# The number of threads used to write the outputs to disk.
+_NUM_WRITER_THREADS = 4
+# The maximum number of outputs waiting to be written, which bounds the memory
+# held by pending writes.
+_MAX_PENDING_WRITES = 64
+
+# The predictions stored by `store_raw_predictions`.
+_RAW_PREDICTION_KEYS = (
+    common.PRED_SEMANTIC_KEY,
+    common.PRED_PANOPTIC_KEY,
+    common.PRED_NEXT_PANOPTIC_KEY,
+    common.PRED_DEPTH_KEY,
+)
+
 # Conversion from train id to eval id.
 _CITYSCAPES_TRAIN_ID_TO_EVAL_ID = (
     7, 8, 11, 12, 13, 17, 19, 20, 21, 22, 23, 24, 25, 26, 27, 28, 31, 32, 33, 0
 )
 _COCO_TRAIN_ID_TO_EVAL_ID = coco_constants.get_id_mapping_inverse()
 
+# Outputs are encoded and written in background threads, so that disk (or
+# network) I/O overlaps with the inference of the next frames. PNG encoding and
+# file writes release the GIL.
+_WRITER_POOL = futures.ThreadPoolExecutor(max_workers=_NUM_WRITER_THREADS)
+atexit.register(_WRITER_POOL.shutdown, wait=True)
+_pending_writes = collections.deque()
 
-def _convert_train_id_to_eval_id(
-    prediction: np.ndarray, dataset_name: str) -> np.ndarray:
-  """Converts the predicted label for evaluation.
 
-  There are cases where the training labels are not equal to the evaluation
-  labels. This function is used to perform the conversion so that we could
-  evaluate the results on the evaluation server.
+def _submit_write(write_fn: Callable[..., Any], *args, **kwargs):
+  """Runs `write_fn(*args, **kwargs)` asynchronously in the writer pool.
+
+  The arrays passed to `write_fn` must not be modified afterwards.
+
+  Args:
+    write_fn: A function writing outputs to disk.
+    *args: Positional arguments for `write_fn`.
+    **kwargs: Keyword arguments for `write_fn`.
+  """
+  while len(_pending_writes) >= _MAX_PENDING_WRITES:
+    _pending_writes.popleft().result()
+  _pending_writes.append(_WRITER_POOL.submit(write_fn, *args, **kwargs))
+
+
+def wait_for_pending_writes():
+  """Blocks until all the outputs submitted so far have been written.
+
+  Raises:
+    The first error that occurred while writing the outputs. All the pending
+    writes are finished before the error is raised.
+  """
+  pending_writes = list(_pending_writes)
+  _pending_writes.clear()
+  futures.wait(pending_writes)
+  for pending_write in pending_writes:
+    pending_write.result()
+
+
+@functools.lru_cache(maxsize=None)
+def _get_raw_output_folder(save_dir: Text,
+                           folder_name: Text,
+                           sequence: Optional[Text] = None) -> Text:
+  """Returns the folder to store raw outputs in.
+
+  The result is cached, so that the path is built and the folder of a video
+  sequence is created only once per process.
+
+  Args:
+    save_dir: A path to the folder to write the output to.
+    folder_name: A string specifying the type of the raw outputs, e.g.
+      'raw_semantic'.
+    sequence: An optional string specifying the video sequence. If set, the
+      sequence folder is created.
+
+  Returns:
+    A path to the folder.
+  """
+  output_folder = os.path.join(save_dir, folder_name)
+  if sequence is not None:
+    output_folder = os.path.join(output_folder, sequence)
+    tf.io.gfile.makedirs(output_folder)
+  return output_folder
+
+
+@functools.lru_cache(maxsize=None)
+def _get_train_id_to_eval_id_lut(dataset_name: str) -> np.ndarray:
+  """Returns the (cached) lookup table mapping train ids to eval ids.
+
+  All supported eval ids fit in 8 bits, so the lookup table is stored as uint8
+  to keep it cache-resident and the converted predictions small.
 
   Args:
-    prediction: Semantic segmentation prediction.
     dataset_name: Dataset name.
 
   Returns:
-    Semantic segmentation prediction whose labels have been changed.
+    A read-only 1-D uint8 numpy array of at least 256 entries, mapping train
+    ids to eval ids.
 
   Raises:
     ValueError: If the dataset is not supported.
@@ -76,20 +155,212 @@ def _convert_train_id_to_eval_id(
         'Unsupported dataset %s for converting semantic class IDs.' %
         dataset_name)
   length = np.maximum(256, len(train_id_to_eval_id))
-  to_eval_id_map = np.zeros((length), dtype=prediction.dtype)
-  dataset_ids = np.asarray(
-      train_id_to_eval_id, dtype=prediction.dtype)
-  to_eval_id_map[:len(train_id_to_eval_id)] = dataset_ids
-  return to_eval_id_map[prediction]
+  to_eval_id_map = np.zeros((length), dtype=np.uint8)
+  to_eval_id_map[:len(train_id_to_eval_id)] = train_id_to_eval_id
+  to_eval_id_map.flags.writeable = False
+  return to_eval_id_map
+
+
+def _convert_train_id_to_eval_id(
+    prediction: np.ndarray, dataset_name: str) -> np.ndarray:
+  """Converts the predicted label for evaluation.
+
+  There are cases where the training labels are not equal to the evaluation
+  labels. This function is used to perform the conversion so that we could
+  evaluate the results on the evaluation server.
+
+  Args:
+    prediction: Semantic segmentation prediction.
+    dataset_name: Dataset name.
+
+  Returns:
+    Semantic segmentation prediction (of type uint8) whose labels have been
+    changed.
+
+  Raises:
+    ValueError: If the dataset is not supported.
+  """
+  to_eval_id_map = _get_train_id_to_eval_id_lut(dataset_name)
+  return np.take(to_eval_id_map, prediction, mode='clip')
+
+
+@functools.lru_cache(maxsize=None)
+def _get_fg_lut(thing_list: Tuple[int, ...]) -> np.ndarray:
+  """Returns the (cached) lookup table marking the thing classes.
+
+  Args:
+    thing_list: A tuple containing the semantic indices of the thing classes.
+
+  Returns:
+    A read-only 1-D uint8 numpy array, which is 1 at the thing classes and 0
+    elsewhere. The last entry is always 0.
+  """
+  fg_lut = np.zeros(max(thing_list, default=-1) + 2, dtype=np.uint8)
+  fg_lut[list(thing_list)] = 1
+  fg_lut.flags.writeable = False
+  return fg_lut
 
 
 def _get_fg_mask(label_map: np.ndarray, thing_list: List[int]) -> np.ndarray:
-  fg_mask = np.zeros_like(label_map, np.bool)
-  for class_id in np.unique(label_map):
-    if class_id in thing_list:
-      fg_mask = np.logical_or(fg_mask, np.equal(label_map, class_id))
-  fg_mask = np.expand_dims(fg_mask, axis=2)
-  return fg_mask.astype(np.int)
+  # The mask is gathered from a lookup table marking the thing classes. Labels
+  # beyond the last thing class are clipped to the last entry, which is 0.
+  # Note that negative labels are not supported: they are clipped to the first
+  # entry, which is 1 if class 0 is a thing class.
+  fg_lut = _get_fg_lut(tuple(thing_list))
+  fg_mask = np.take(fg_lut, label_map, mode='clip')
+  return np.expand_dims(fg_mask, axis=2)
+
+
+def _get_max_semantic_label(dataset_info: dataset.DatasetDescriptor,
+                            convert_to_eval: bool) -> int:
+  """Returns an upper bound of the semantic labels in the raw predictions.
+
+  Args:
+    dataset_info: A dataset.DatasetDescriptor specifying the dataset.
+    convert_to_eval: A flag specifying whether semantic class IDs are converted
+      to eval IDs.
+
+  Returns:
+    The largest semantic label that could appear in the raw predictions.
+  """
+  if convert_to_eval:
+    return int(np.max(_get_train_id_to_eval_id_lut(dataset_info.dataset_name)))
+  # Unconfident regions of the panoptic prediction are set to the void label,
+  # which is the ignore label of the dataset.
+  return max(dataset_info.num_classes - 1, dataset_info.ignore_label)
+
+
+def _encode_raw_panoptic(
+    panoptic_prediction: np.ndarray,
+    dataset_info: dataset.DatasetDescriptor,
+    raw_panoptic_format: Text,
+    convert_to_eval: bool) -> np.ndarray:
+  """Encodes panoptic predictions in the specified raw panoptic format.
+
+  Args:
+    panoptic_prediction: Panoptic predictions of shape [..., height, width].
+    dataset_info: A dataset.DatasetDescriptor specifying the dataset.
+    raw_panoptic_format: A string specifying the raw panoptic format. See
+      `store_raw_predictions` for the supported formats.
+    convert_to_eval: A flag specifying whether semantic class IDs should be
+      converted to eval IDs.
+
+  Returns:
+    A numpy array of shape [..., height, width, channels] with the encoded
+    panoptic predictions.
+
+  Raises:
+    ValueError: An error occurs when semantic label or instance ID is larger
+      than the values supported by the 'two_channel_png' or 'three_channel_png'
+      format. Or, if the raw_panoptic_format is not supported.
+  """
+  label_divisor = dataset_info.panoptic_label_divisor
+  # Split the panoptic prediction into semantic and instance labels in a
+  # single pass.
+  predicted_semantic_labels, predicted_instance_labels = np.divmod(
+      panoptic_prediction, label_divisor)
+  if convert_to_eval:
+    # Note that the converted semantic prediction could not be reused here: the
+    # post-processors assign the void label to unconfident regions of the
+    # panoptic prediction, so its semantic labels generally differ from the
+    # semantic prediction.
+    predicted_semantic_labels = _convert_train_id_to_eval_id(
+        predicted_semantic_labels, dataset_info.dataset_name)
+  # Skip the overflow checks that could never fail for this dataset.
+  check_semantic_overflow = (
+      _get_max_semantic_label(dataset_info, convert_to_eval) > 255)
+
+  if raw_panoptic_format == 'two_channel_png':
+    # The R-channel stores the semantic label while the G-channel stores the
+    # instance label.
+    if check_semantic_overflow and np.max(predicted_semantic_labels) > 255:
+      raise ValueError('Overflow: Semantic IDs greater 255 are not supported '
+                       'for images of 8-bit. Please save output as numpy '
+                       'arrays instead.')
+    if label_divisor > 256 and np.max(predicted_instance_labels) > 255:
+      raise ValueError(
+          'Overflow: Instance IDs greater 255 could not be encoded by '
+          'G channel. Please save output as numpy arrays instead.')
+    # All the values fit in 8 bits after the overflow checks above.
+    panoptic_outputs = np.zeros(panoptic_prediction.shape + (3,),
+                                dtype=np.uint8)
+    panoptic_outputs[..., 0] = predicted_semantic_labels
+    panoptic_outputs[..., 1] = predicted_instance_labels
+  elif raw_panoptic_format == 'three_channel_png':
+    if check_semantic_overflow and np.max(predicted_semantic_labels) > 255:
+      raise ValueError('Overflow: Semantic IDs greater 255 are not supported '
+                       'for images of 8-bit. Please save output as numpy '
+                       'arrays instead.')
+    if label_divisor > 65536 and np.max(predicted_instance_labels) > 65535:
+      raise ValueError(
+          'Overflow: Instance IDs greater 65535 could not be encoded by '
+          'G and B channels. Please save output as numpy arrays instead.')
+    # All the values fit in 8 bits after the overflow checks above.
+    panoptic_outputs = np.empty(panoptic_prediction.shape + (3,),
+                                dtype=np.uint8)
+    panoptic_outputs[..., 0] = predicted_semantic_labels
+    np.divmod(predicted_instance_labels, 256,
+              out=(panoptic_outputs[..., 1], panoptic_outputs[..., 2]),
+              casting='unsafe')
+  elif raw_panoptic_format == 'two_channel_numpy_array':
+    panoptic_outputs = np.stack(
+        [predicted_semantic_labels, predicted_instance_labels], axis=-1)
+  else:
+    raise ValueError(
+        'Unknown raw_panoptic_format %s.' % raw_panoptic_format)
+  return panoptic_outputs
+
+
+def _save_raw_panoptic(panoptic_outputs: np.ndarray,
+                       output_folder: Text,
+                       filename: Text,
+                       raw_panoptic_format: Text):
+  """Saves panoptic predictions encoded by `_encode_raw_panoptic`."""
+  if raw_panoptic_format == 'two_channel_numpy_array':
+    with tf.io.gfile.GFile(
+        os.path.join(output_folder, filename + '.npy'), 'w') as f:
+      np.save(f, panoptic_outputs)
+  else:
+    vis_utils.save_annotation(
+        panoptic_outputs,
+        output_folder,
+        filename,
+        add_colormap=False)
+
+
+def _save_raw_depth(depth_outputs: np.ndarray,
+                    output_folder: Text,
+                    filename: Text):
+  """Saves depth predictions as 16-bit PNG images."""
+  vis_utils.save_annotation(
+      np.squeeze(depth_outputs),
+      output_folder,
+      filename,
+      add_colormap=False,
+      scale_factor=256,
+      output_dtype=np.uint16)
+
+
+def _batch_apply(fn: Callable[[np.ndarray], np.ndarray],
+                 arrays: Sequence[np.ndarray]) -> List[np.ndarray]:
+  """Applies `fn` to a batch of arrays and returns the per-array results.
+
+  If there are several arrays of the same shape, `fn` is applied once to the
+  arrays stacked along a new batch axis. Otherwise, `fn` is applied to each
+  array separately, with the batch axis added as a view so that a single array
+  is not copied.
+
+  Args:
+    fn: A function mapping an array of shape [batch, ...] to an array of shape
+      [batch, ...].
+    arrays: A sequence of numpy arrays.
+
+  Returns:
+    A list with the result of `fn` for each of the `arrays`.
+  """
+  if len(arrays) > 1 and len({array.shape for array in arrays}) == 1:
+    return list(fn(np.stack(arrays)))
+  return [fn(array[np.newaxis])[0] for array in arrays]
 
 
 def store_raw_predictions(predictions: Dict[str, Any],
@@ -110,6 +381,9 @@ def store_raw_predictions(predictions: Dict[str, Any],
   the raw predictions as two channel numpy array (i.e., first channel encodes
   the semantic class and the second channel the instance ID).
 
+  The outputs are written asynchronously. Callers must call
+  `wait_for_pending_writes` before reading the outputs back.
+
   Args:
     predictions: A dctionary with string keys and any content. Tensors under
       common.PRED_SEMANTIC_KEY and common.PRED_PANOPTIC_KEY will be stored.
@@ -141,120 +415,136 @@ def store_raw_predictions(predictions: Dict[str, Any],
       than the values supported by the 'two_channel_png' or 'three_channel_png'
       format. Or, if the raw_panoptic_format is not supported.
   """
-  # Note: predictions[key] contains a tuple of length 1.
-  predictions = {key: predictions[key][0] for key in predictions}
-  predictions = vis_utils.squeeze_batch_dim_and_convert_to_numpy(predictions)
-  image_filename = image_filename.numpy().decode('utf-8')
-  image_filename = os.path.splitext(image_filename)[0]
+  store_raw_predictions_batch(
+      [predictions], [image_filename],
+      dataset_info,
+      save_dir,
+      [sequence],
+      raw_panoptic_format=raw_panoptic_format,
+      convert_to_eval=convert_to_eval)
 
-  # Store raw semantic prediction.
-  semantic_prediction = predictions[common.PRED_SEMANTIC_KEY]
-  if convert_to_eval:
-    semantic_prediction = _convert_train_id_to_eval_id(
-        semantic_prediction, dataset_info.dataset_name)
-  output_folder = os.path.join(save_dir, 'raw_semantic')
+
+def store_raw_predictions_batch(predictions_list: Sequence[Dict[str, Any]],
+                                image_filenames: Sequence[tf.Tensor],
+                                dataset_info: dataset.DatasetDescriptor,
+                                save_dir: Text,
+                                sequences: Optional[Sequence[tf.Tensor]],
+                                raw_panoptic_format='two_channel_png',
+                                convert_to_eval=True):
+  """Stores raw predictions of multiple frames to the specified path.
+
+  This function stores the same outputs as calling `store_raw_predictions` on
+  each frame. The label conversions of frames with the same spatial size are
+  performed once on the stacked predictions. As with `store_raw_predictions`,
+  callers must call `wait_for_pending_writes` before reading the outputs back.
+
+  Args:
+    predictions_list: A sequence of prediction dictionaries, one per frame, as
+      passed to `store_raw_predictions`.
+    image_filenames: A sequence of tf.Tensors containing the image filenames.
+    dataset_info: A dataset.DatasetDescriptor specifying the dataset.
+    save_dir: A path to the folder to write the output to.
+    sequences: A sequence of tf.Tensors describing the sequence that each image
+      belongs to. Only used for video datasets.
+    raw_panoptic_format: A string specifying what format the panoptic output
+      should be stored. See `store_raw_predictions` for the supported formats.
+    convert_to_eval: A flag specyfing whether semantic class IDs should be
+      converted to eval IDs.
+
+  Raises:
+    ValueError: An error occurs when semantic label or instance ID is larger
+      than the values supported by the 'two_channel_png' or 'three_channel_png'
+      format. Or, if the raw_panoptic_format is not supported. Or, if the
+      frames do not contain the same predictions.
+  """
+  if not predictions_list:
+    return
+  # Note: predictions[key] contains a tuple of length 1. Only the stored
+  # predictions are converted to numpy.
+  predictions_list = [
+      vis_utils.squeeze_batch_dim_and_convert_to_numpy(
+          {key: predictions[key][0] for key in _RAW_PREDICTION_KEYS
+           if key in predictions})
+      for predictions in predictions_list]
+  prediction_keys = set(predictions_list[0])
+  for predictions in predictions_list[1:]:
+    if set(predictions) != prediction_keys:
+      raise ValueError(
+          'All the frames must contain the same predictions. Got %s and %s.' %
+          (sorted(prediction_keys), sorted(predictions)))
+  image_filenames = [
+      os.path.splitext(image_filename.numpy().decode('utf-8'))[0]
+      for image_filename in image_filenames]
   if dataset_info.is_video_dataset:
-    sequence = sequence.numpy().decode('utf-8')
-    output_folder = os.path.join(output_folder, sequence)
-    tf.io.gfile.makedirs(output_folder)
-  vis_utils.save_annotation(
-      semantic_prediction,
-      output_folder,
-      image_filename,
-      add_colormap=False)
+    sequences = [sequence.numpy().decode('utf-8') for sequence in sequences]
+  else:
+    sequences = [None] * len(image_filenames)
 
+  def get_output_folders(folder_name):
+    return [_get_raw_output_folder(save_dir, folder_name, sequence)
+            for sequence in sequences]
+
+  # Convert and encode all the predictions first, so that an overflow error is
+  # raised before any file is written.
+  semantic_predictions = [
+      predictions[common.PRED_SEMANTIC_KEY] for predictions in predictions_list]
+  if convert_to_eval:
+    semantic_predictions = _batch_apply(
+        functools.partial(_convert_train_id_to_eval_id,
+                          dataset_name=dataset_info.dataset_name),
+        semantic_predictions)
   pred_panoptic_keys = [common.PRED_PANOPTIC_KEY, common.PRED_NEXT_PANOPTIC_KEY]
-  pred_panoptic_keys = filter(lambda k: k in predictions, pred_panoptic_keys)
+  pred_panoptic_keys = [k for k in pred_panoptic_keys if k in prediction_keys]
+  panoptic_outputs = {}
   for pred_panoptic_key in pred_panoptic_keys:
-    panoptic_filename = image_filename
-    if pred_panoptic_key == common.PRED_NEXT_PANOPTIC_KEY:
-      panoptic_filename += '_next'
-    # Save the predicted panoptic annotations in two-channel format, where the
-    # R-channel stores the semantic label while the G-channel stores the
-    # instance label.
-    panoptic_prediction = predictions[pred_panoptic_key]
-    panoptic_outputs = np.zeros(
-        (panoptic_prediction.shape[0], panoptic_prediction.shape[1], 3),
-        dtype=panoptic_prediction.dtype)
-    predicted_semantic_labels = (
-        panoptic_prediction // dataset_info.panoptic_label_divisor)
-    if convert_to_eval:
-      predicted_semantic_labels = _convert_train_id_to_eval_id(
-          predicted_semantic_labels, dataset_info.dataset_name)
-    predicted_instance_labels = predictions[
-        pred_panoptic_key] % dataset_info.panoptic_label_divisor
-
-    output_folder = os.path.join(save_dir, 'raw_panoptic')
-    if dataset_info.is_video_dataset:
-      output_folder = os.path.join(output_folder, sequence)
-      tf.io.gfile.makedirs(output_folder)
-    if raw_panoptic_format == 'two_channel_png':
-      if np.max(predicted_semantic_labels) > 255:
-        raise ValueError('Overflow: Semantic IDs greater 255 are not supported '
-                         'for images of 8-bit. Please save output as numpy '
-                         'arrays instead.')
-      if np.max(predicted_instance_labels) > 255:
-        raise ValueError(
-            'Overflow: Instance IDs greater 255 could not be encoded by '
-            'G channel. Please save output as numpy arrays instead.')
-      panoptic_outputs[:, :, 0] = predicted_semantic_labels
-      panoptic_outputs[:, :, 1] = predicted_instance_labels
-      vis_utils.save_annotation(
-          panoptic_outputs,
-          output_folder,
-          panoptic_filename,
-          add_colormap=False)
-    elif raw_panoptic_format == 'three_channel_png':
-      if np.max(predicted_semantic_labels) > 255:
-        raise ValueError('Overflow: Semantic IDs greater 255 are not supported '
-                         'for images of 8-bit. Please save output as numpy '
-                         'arrays instead.')
-      if np.max(predicted_instance_labels) > 65535:
-        raise ValueError(
-            'Overflow: Instance IDs greater 65535 could not be encoded by '
-            'G and B channels. Please save output as numpy arrays instead.')
-      panoptic_outputs[:, :, 0] = predicted_semantic_labels
-      panoptic_outputs[:, :, 1] = predicted_instance_labels // 256
-      panoptic_outputs[:, :, 2] = predicted_instance_labels % 256
-      vis_utils.save_annotation(
-          panoptic_outputs,
-          output_folder,
-          panoptic_filename,
-          add_colormap=False)
-    elif raw_panoptic_format == 'two_channel_numpy_array':
-      panoptic_outputs[:, :, 0] = predicted_semantic_labels
-      panoptic_outputs[:, :, 1] = predicted_instance_labels
-      with tf.io.gfile.GFile(
-          os.path.join(output_folder, panoptic_filename + '.npy'), 'w') as f:
-        np.save(f, panoptic_outputs)
-    else:
-      raise ValueError(
-          'Unknown raw_panoptic_format %s.' % raw_panoptic_format)
-
-  if common.PRED_DEPTH_KEY in predictions:
-    output_folder = os.path.join(save_dir, 'raw_depth')
-    if dataset_info.is_video_dataset:
-      output_folder = os.path.join(output_folder, sequence)
-      tf.io.gfile.makedirs(output_folder)
-    depth_outputs = predictions[common.PRED_DEPTH_KEY]
-    depth_outputs = np.squeeze(depth_outputs)
-    vis_utils.save_annotation(
-        depth_outputs,
+    panoptic_outputs[pred_panoptic_key] = _batch_apply(
+        functools.partial(_encode_raw_panoptic,
+                          dataset_info=dataset_info,
+                          raw_panoptic_format=raw_panoptic_format,
+                          convert_to_eval=convert_to_eval),
+        [predictions[pred_panoptic_key] for predictions in predictions_list])
+
+  output_folders = get_output_folders('raw_semantic')
+  for semantic_prediction, output_folder, image_filename in zip(
+      semantic_predictions, output_folders, image_filenames):
+    _submit_write(
+        vis_utils.save_annotation,
+        semantic_prediction,
         output_folder,
         image_filename,
-        add_colormap=False,
-        scale_factor=256,
-        output_dtype=np.uint16)
+        add_colormap=False)
+
+  if pred_panoptic_keys:
+    output_folders = get_output_folders('raw_panoptic')
+  for pred_panoptic_key in pred_panoptic_keys:
+    suffix = ''
+    if pred_panoptic_key == common.PRED_NEXT_PANOPTIC_KEY:
+      suffix = '_next'
+    for outputs, output_folder, image_filename in zip(
+        panoptic_outputs[pred_panoptic_key], output_folders, image_filenames):
+      _submit_write(_save_raw_panoptic, outputs, output_folder,
+                    image_filename + suffix, raw_panoptic_format)
+
+  if common.PRED_DEPTH_KEY in prediction_keys:
+    output_folders = get_output_folders('raw_depth')
+    for predictions, output_folder, image_filename in zip(
+        predictions_list, output_folders, image_filenames):
+      _submit_write(_save_raw_depth, predictions[common.PRED_DEPTH_KEY],
+                    output_folder, image_filename)
 
 
 def store_predictions(predictions: Dict[str, Any], inputs: Dict[str, Any],
                       image_id: int, dataset_info: dataset.DatasetDescriptor,
                       save_dir: Text):
-  """Saves predictions and labels to the specified path."""
-  predictions = {key: predictions[key][0] for key in predictions}
+  """Saves predictions and labels to the specified path.
+
+  The outputs are written asynchronously. Callers must call
+  `wait_for_pending_writes` before reading the outputs back.
+  """
+  predictions = {key: value[0] for key, value in predictions.items()}
   predictions = vis_utils.squeeze_batch_dim_and_convert_to_numpy(predictions)
-  inputs = {key: inputs[key][0] for key in inputs}
-  del inputs[common.IMAGE_NAME]
+  inputs = {key: value[0] for key, value in inputs.items()
+            if key != common.IMAGE_NAME}
   inputs = vis_utils.squeeze_batch_dim_and_convert_to_numpy(inputs)
 
   thing_list = dataset_info.class_has_instances_list
@@ -263,20 +553,23 @@ def store_predictions(predictions: Dict[str, Any], inputs: Dict[str, Any],
 
   # 1. Save image.
   image = inputs[common.IMAGE]
-  vis_utils.save_annotation(
+  _submit_write(
+      vis_utils.save_annotation,
       image,
       save_dir,
       _IMAGE_FORMAT % image_id,
       add_colormap=False)
 
   # 2. Save semantic predictions and semantic labels.
-  vis_utils.save_annotation(
+  _submit_write(
+      vis_utils.save_annotation,
       predictions[common.PRED_SEMANTIC_KEY],
       save_dir,
       _SEMANTIC_PREDICTION_FORMAT % image_id,
       add_colormap=True,
       colormap_name=colormap_name)
-  vis_utils.save_annotation(
+  _submit_write(
+      vis_utils.save_annotation,
       inputs[common.GT_SEMANTIC_RAW],
       save_dir,
       _SEMANTIC_LABEL_FORMAT % image_id,
@@ -287,14 +580,16 @@ def store_predictions(predictions: Dict[str, Any], inputs: Dict[str, Any],
     # 3. Save center heatmap.
     heatmap_pred = predictions[common.PRED_CENTER_HEATMAP_KEY]
     heat_map_gt = inputs[common.GT_INSTANCE_CENTER_KEY]
-    vis_utils.save_annotation(
+    _submit_write(
+        vis_utils.save_annotation,
         vis_utils.overlay_heatmap_on_image(
             heatmap_pred,
             image),
         save_dir,
         _CENTER_HEATMAP_PREDICTION_FORMAT % image_id,
         add_colormap=False)
-    vis_utils.save_annotation(
+    _submit_write(
+        vis_utils.save_annotation,
         vis_utils.overlay_heatmap_on_image(
             heat_map_gt,
             image),
@@ -309,9 +604,10 @@ def store_predictions(predictions: Dict[str, Any], inputs: Dict[str, Any],
         center_offset_prediction)
     semantic_prediction = predictions[common.PRED_SEMANTIC_KEY]
     pred_fg_mask = _get_fg_mask(semantic_prediction, thing_list)
-    center_offset_prediction_rgb = (
-        center_offset_prediction_rgb * pred_fg_mask)
-    vis_utils.save_annotation(
+    # flow_to_color returns a new array, so the mask is applied in place.
+    center_offset_prediction_rgb *= pred_fg_mask
+    _submit_write(
+        vis_utils.save_annotation,
         center_offset_prediction_rgb,
         save_dir,
         _OFFSET_PREDICTION_RGB_FORMAT % image_id,
@@ -320,9 +616,10 @@ def store_predictions(predictions: Dict[str, Any], inputs: Dict[str, Any],
     center_offset_label = inputs[common.GT_INSTANCE_REGRESSION_KEY]
     center_offset_label_rgb = vis_utils.flow_to_color(center_offset_label)
     gt_fg_mask = _get_fg_mask(inputs[common.GT_SEMANTIC_RAW], thing_list)
-    center_offset_label_rgb = center_offset_label_rgb * gt_fg_mask
+    center_offset_label_rgb *= gt_fg_mask
 
-    vis_utils.save_annotation(
+    _submit_write(
+        vis_utils.save_annotation,
         center_offset_label_rgb,
         save_dir,
         _OFFSET_LABEL_FORMAT % image_id,
@@ -330,7 +627,8 @@ def store_predictions(predictions: Dict[str, Any], inputs: Dict[str, Any],
 
   if common.PRED_INSTANCE_KEY in predictions:
     # 5. Save instance map.
-    vis_utils.save_annotation(
+    _submit_write(
+        vis_utils.save_annotation,
         vis_utils.create_rgb_from_instance_map(
             predictions[common.PRED_INSTANCE_KEY]),
         save_dir,
@@ -339,14 +637,16 @@ def store_predictions(predictions: Dict[str, Any], inputs: Dict[str, Any],
 
   if common.PRED_PANOPTIC_KEY in predictions:
     # 6. Save panoptic segmentation.
-    vis_utils.save_parsing_result(
+    _submit_write(
+        vis_utils.save_parsing_result,
         predictions[common.PRED_PANOPTIC_KEY],
         label_divisor=label_divisor,
         thing_list=thing_list,
         save_dir=save_dir,
         filename=_PANOPTIC_PREDICTION_FORMAT % image_id,
         colormap_name=colormap_name)
-    vis_utils.save_parsing_result(
+    _submit_write(
+        vis_utils.save_parsing_result,
         parsing_result=inputs[common.GT_PANOPTIC_RAW],
         label_divisor=label_divisor,
         thing_list=thing_list,
@@ -355,11 +655,15 @@ def store_predictions(predictions: Dict[str, Any], inputs: Dict[str, Any],
         colormap_name=colormap_name)
 
   # 7. Save error of semantic prediction.
+  # The boolean masks are combined in place and reinterpreted as uint8, which
+  # avoids allocating intermediate arrays.
   label = inputs[common.GT_SEMANTIC_RAW].astype(np.uint8)
-  error_prediction = (
-      (predictions[common.PRED_SEMANTIC_KEY] != label) &
-      (label != dataset_info.ignore_label)).astype(np.uint8) * 255
-  vis_utils.save_annotation(
+  error_prediction = np.not_equal(predictions[common.PRED_SEMANTIC_KEY], label)
+  error_prediction &= np.not_equal(label, dataset_info.ignore_label)
+  error_prediction = error_prediction.view(np.uint8)
+  error_prediction *= 255
+  _submit_write(
+      vis_utils.save_annotation,
       error_prediction,
       save_dir,
       _ANALYSIS_FORMAT % (image_id),
@@ -0,0 +1,286 @@
+# coding=utf-8
+# Copyright 2022 The Deeplab2 Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for vis.py."""
+
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from deeplab2 import common
+from deeplab2.data import dataset
+from deeplab2.trainer import vis
+from deeplab2.trainer import vis_utils
+
+_DATASET_INFO = dataset.CITYSCAPES_PANOPTIC_INFORMATION
+
+
+def _create_predictions(height, width, seed=0):
+  """Creates random raw predictions of a single frame."""
+  rng = np.random.RandomState(seed)
+  semantic = rng.randint(0, 19, size=(1, height, width)).astype(np.int32)
+  instance = rng.randint(0, 50, size=(1, height, width)).astype(np.int32)
+  panoptic = semantic * _DATASET_INFO.panoptic_label_divisor + instance
+  depth = rng.uniform(0.0, 80.0, size=(1, height, width)).astype(np.float32)
+  # Each prediction is a tuple of length 1, as returned by the evaluator.
+  return {
+      common.PRED_SEMANTIC_KEY: (tf.constant(semantic),),
+      common.PRED_PANOPTIC_KEY: (tf.constant(panoptic),),
+      common.PRED_DEPTH_KEY: (tf.constant(depth),),
+  }
+
+
+def _read_png(save_dir, filename):
+  return tf.io.decode_png(
+      tf.io.read_file(os.path.join(save_dir, filename + '.png'))).numpy()
+
+
+def _read_output_files(save_dir):
+  """Returns a dict mapping relative file paths to their contents."""
+  outputs = {}
+  for root, _, filenames in tf.io.gfile.walk(save_dir):
+    for filename in filenames:
+      path = os.path.join(root, filename)
+      with tf.io.gfile.GFile(path, 'rb') as f:
+        outputs[os.path.relpath(path, save_dir)] = f.read()
+  return outputs
+
+
+def _create_raw_output_dir(save_dir):
+  """Creates the raw output folders, as done by the evaluator."""
+  for folder_name in ('raw_semantic', 'raw_panoptic', 'raw_depth'):
+    tf.io.gfile.makedirs(os.path.join(save_dir, folder_name))
+  return save_dir
+
+
+class VisTest(tf.test.TestCase):
+
+  def _assert_batch_matches_per_frame(self, sizes, raw_panoptic_format):
+    predictions_list = [
+        _create_predictions(height, width, seed)
+        for seed, (height, width) in enumerate(sizes)]
+    image_filenames = [
+        tf.constant(b'frame_%d.png' % i) for i in range(len(sizes))]
+
+    per_frame_dir = _create_raw_output_dir(self.create_tempdir().full_path)
+    for predictions, image_filename in zip(predictions_list, image_filenames):
+      vis.store_raw_predictions(
+          predictions, image_filename, _DATASET_INFO, per_frame_dir, None,
+          raw_panoptic_format=raw_panoptic_format)
+    batch_dir = _create_raw_output_dir(self.create_tempdir().full_path)
+    vis.store_raw_predictions_batch(
+        predictions_list, image_filenames, _DATASET_INFO, batch_dir, None,
+        raw_panoptic_format=raw_panoptic_format)
+    vis.wait_for_pending_writes()
+
+    per_frame_outputs = _read_output_files(per_frame_dir)
+    # Semantic, panoptic and depth outputs for each frame.
+    self.assertLen(per_frame_outputs, 3 * len(sizes))
+    self.assertDictEqual(per_frame_outputs, _read_output_files(batch_dir))
+
+  def test_store_raw_predictions_batch_same_size(self):
+    for raw_panoptic_format in ('two_channel_png', 'three_channel_png',
+                                'two_channel_numpy_array'):
+      self._assert_batch_matches_per_frame(
+          [(8, 12), (8, 12), (8, 12)], raw_panoptic_format)
+
+  def test_store_raw_predictions_batch_mixed_size(self):
+    for raw_panoptic_format in ('two_channel_png', 'three_channel_png',
+                                'two_channel_numpy_array'):
+      self._assert_batch_matches_per_frame(
+          [(8, 12), (6, 10), (8, 12)], raw_panoptic_format)
+
+  def test_batch_apply_does_not_copy_single_array(self):
+    array = np.arange(6).reshape(2, 3)
+    outputs = vis._batch_apply(lambda x: x, [array])
+    self.assertLen(outputs, 1)
+    self.assertTrue(np.shares_memory(outputs[0], array))
+
+  def test_get_fg_mask(self):
+
+    def get_fg_mask_reference(label_map, thing_list):
+      fg_mask = np.zeros_like(label_map, np.bool_)
+      for class_id in np.unique(label_map):
+        if class_id in thing_list:
+          fg_mask = np.logical_or(fg_mask, np.equal(label_map, class_id))
+      return np.expand_dims(fg_mask, axis=2).astype(np.int32)
+
+    # Semantic labels are non-negative, and 255 is the ignore label.
+    label_map = np.array([[0, 1, 7, 8], [11, 18, 19, 255], [3, 12, 24, 33]],
+                         dtype=np.int32)
+    for thing_list in (
+        # Class 0 is a thing class.
+        list(range(8)),
+        _DATASET_INFO.class_has_instances_list,
+        []):
+      for dtype in (np.int32, np.int64, np.uint8):
+        labels = label_map.astype(dtype)
+        self.assertAllEqual(
+            vis._get_fg_mask(labels, thing_list),
+            get_fg_mask_reference(labels, thing_list))
+
+  def test_store_predictions(self):
+    # Cityscapes thing classes are 11 to 18, and 255 is the ignore label.
+    semantic_prediction = np.array([[0, 11, 12, 18], [5, 5, 255, 13]],
+                                   dtype=np.int32)
+    semantic_label = np.array([[0, 12, 12, 255], [6, 5, 18, 255]],
+                              dtype=np.int32)
+    rng = np.random.RandomState(0)
+    offset_prediction = rng.uniform(-5.0, 5.0, (2, 4, 2)).astype(np.float32)
+    offset_label = rng.uniform(-5.0, 5.0, (2, 4, 2)).astype(np.float32)
+    predictions = {
+        common.PRED_SEMANTIC_KEY: (tf.constant(semantic_prediction[None]),),
+        common.PRED_OFFSET_MAP_KEY: (tf.constant(offset_prediction[None]),),
+    }
+    inputs = {
+        common.IMAGE: (tf.zeros([1, 2, 4, 3]),),
+        common.GT_SEMANTIC_RAW: (tf.constant(semantic_label[None]),),
+        common.GT_INSTANCE_REGRESSION_KEY: (tf.constant(offset_label[None]),),
+        common.IMAGE_NAME: (tf.constant([b'image.png']),),
+    }
+    save_dir = self.create_tempdir().full_path
+
+    vis.store_predictions(predictions, inputs, 3, _DATASET_INFO, save_dir)
+    vis.wait_for_pending_writes()
+
+    # Pixels with the ignore label are not counted as errors.
+    self.assertAllEqual(
+        _read_png(save_dir, '000003_semantic_error')[..., 0],
+        [[0, 255, 0, 0], [255, 0, 255, 0]])
+    # The offsets are only drawn on the thing classes.
+    self.assertAllEqual(
+        _read_png(save_dir, '000003_offset_prediction_rgb'),
+        vis_utils.flow_to_color(offset_prediction) *
+        np.array([[0, 1, 1, 1], [0, 0, 0, 1]], dtype=np.uint8)[..., None])
+    self.assertAllEqual(
+        _read_png(save_dir, '000003_offset_label'),
+        vis_utils.flow_to_color(offset_label) *
+        np.array([[0, 1, 1, 0], [0, 0, 1, 0]], dtype=np.uint8)[..., None])
+
+  def test_wait_for_pending_writes_flushes_outputs(self):
+    save_dir = _create_raw_output_dir(self.create_tempdir().full_path)
+    vis.store_raw_predictions(
+        _create_predictions(8, 12), tf.constant(b'frame.png'), _DATASET_INFO,
+        save_dir, None)
+    vis.wait_for_pending_writes()
+    for folder_name in ('raw_semantic', 'raw_panoptic', 'raw_depth'):
+      self.assertTrue(
+          os.path.isfile(os.path.join(save_dir, folder_name, 'frame.png')))
+
+  def test_wait_for_pending_writes_reraises_write_error(self):
+    # The outputs cannot be written under a regular file.
+    save_dir = self.create_tempfile().full_path
+    vis.store_raw_predictions(
+        _create_predictions(8, 12), tf.constant(b'frame.png'), _DATASET_INFO,
+        save_dir, None)
+    with self.assertRaises(tf.errors.OpError):
+      vis.wait_for_pending_writes()
+    # The failed writes are not raised again.
+    vis.wait_for_pending_writes()
+
+  def test_store_raw_predictions_batch_rejects_mixed_predictions(self):
+    predictions_list = [_create_predictions(4, 4), _create_predictions(4, 4)]
+    del predictions_list[1][common.PRED_DEPTH_KEY]
+    image_filenames = [tf.constant(b'frame_0.png'), tf.constant(b'frame_1.png')]
+    with self.assertRaisesRegex(ValueError, 'same predictions'):
+      vis.store_raw_predictions_batch(
+          predictions_list, image_filenames, _DATASET_INFO,
+          self.create_tempdir().full_path, None)
+
+  def test_encode_raw_panoptic(self):
+    # Cityscapes uses a label divisor of 1000.
+    panoptic_prediction = np.array([[3, 1000], [18007, 255000]], dtype=np.int32)
+    instance_labels = np.array([[3, 0], [7, 0]])
+    for convert_to_eval, semantic_labels in (
+        (False, np.array([[0, 1], [18, 255]])),
+        (True, np.array([[7, 8], [33, 0]]))):
+      panoptic_outputs = vis._encode_raw_panoptic(
+          panoptic_prediction, _DATASET_INFO, 'two_channel_png',
+          convert_to_eval)
+      self.assertEqual(panoptic_outputs.dtype, np.uint8)
+      self.assertAllEqual(
+          panoptic_outputs,
+          np.stack([semantic_labels, instance_labels,
+                    np.zeros_like(semantic_labels)], axis=-1))
+
+      panoptic_outputs = vis._encode_raw_panoptic(
+          panoptic_prediction, _DATASET_INFO, 'three_channel_png',
+          convert_to_eval)
+      self.assertEqual(panoptic_outputs.dtype, np.uint8)
+      self.assertAllEqual(
+          panoptic_outputs,
+          np.stack([semantic_labels, instance_labels // 256,
+                    instance_labels % 256], axis=-1))
+
+      panoptic_outputs = vis._encode_raw_panoptic(
+          panoptic_prediction, _DATASET_INFO, 'two_channel_numpy_array',
+          convert_to_eval)
+      self.assertEqual(panoptic_outputs.shape, (2, 2, 2))
+      self.assertAllEqual(
+          panoptic_outputs,
+          np.stack([semantic_labels, instance_labels], axis=-1))
+
+  def test_encode_raw_panoptic_three_channel_png(self):
+    panoptic_prediction = np.array([[11300]], dtype=np.int32)
+    panoptic_outputs = vis._encode_raw_panoptic(
+        panoptic_prediction, _DATASET_INFO, 'three_channel_png',
+        convert_to_eval=False)
+    self.assertEqual(panoptic_outputs.dtype, np.uint8)
+    # Instance ID 300 is encoded as 1 * 256 + 44.
+    self.assertAllEqual(panoptic_outputs, [[[11, 1, 44]]])
+
+  def test_encode_raw_panoptic_unknown_format(self):
+    with self.assertRaisesRegex(ValueError, 'Unknown raw_panoptic_format'):
+      vis._encode_raw_panoptic(
+          np.zeros((2, 2), dtype=np.int32), _DATASET_INFO, 'jpeg',
+          convert_to_eval=False)
+
+  def test_encode_raw_panoptic_semantic_overflow(self):
+    dataset_info = _DATASET_INFO._replace(num_classes=300)
+    panoptic_prediction = np.array(
+        [[299 * dataset_info.panoptic_label_divisor + 1]], dtype=np.int32)
+    for raw_panoptic_format in ('two_channel_png', 'three_channel_png'):
+      with self.assertRaisesRegex(ValueError, 'Semantic IDs greater 255'):
+        vis._encode_raw_panoptic(
+            panoptic_prediction, dataset_info, raw_panoptic_format,
+            convert_to_eval=False)
+
+  def test_encode_raw_panoptic_two_channel_png_instance_overflow(self):
+    # Cityscapes uses a label divisor of 1000.
+    panoptic_prediction = np.array([[11000 + 256]], dtype=np.int32)
+    for convert_to_eval in (True, False):
+      with self.assertRaisesRegex(ValueError, 'Instance IDs greater 255'):
+        vis._encode_raw_panoptic(
+            panoptic_prediction, _DATASET_INFO, 'two_channel_png',
+            convert_to_eval)
+
+  def test_encode_raw_panoptic_three_channel_png_instance_overflow(self):
+    dataset_info = _DATASET_INFO._replace(panoptic_label_divisor=100000)
+    panoptic_prediction = np.array([[11 * 100000 + 65536]], dtype=np.int32)
+    for convert_to_eval in (True, False):
+      with self.assertRaisesRegex(ValueError, 'Instance IDs greater 65535'):
+        vis._encode_raw_panoptic(
+            panoptic_prediction, dataset_info, 'three_channel_png',
+            convert_to_eval)
+    # Instance IDs up to 65535 are encoded in the G and B channels.
+    panoptic_outputs = vis._encode_raw_panoptic(
+        panoptic_prediction - 1, dataset_info, 'three_channel_png',
+        convert_to_eval=False)
+    self.assertAllEqual(panoptic_outputs, [[[11, 255, 255]]])
+
+
+if __name__ == '__main__':
+  tf.test.main()